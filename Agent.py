@@ -1,6 +1,10 @@
 import sys
 import os
-import openai
+import re
+import asyncio
+from collections import OrderedDict
+
+import qasync
 
 from PyQt5.QtWidgets import (
     QApplication,
@@ -16,61 +20,286 @@ from PyQt5.QtWidgets import (
     QTabWidget,
     QPlainTextEdit
 )
-from PyQt5.QtCore import Qt, QUrl
-from PyQt5.QtGui import QColor, QTextCharFormat, QFont, QSyntaxHighlighter
-from PyQt5.QtWebEngineWidgets import QWebEngineView
+from PyQt5.QtCore import Qt, QTimer, QUrl
+from PyQt5.QtGui import (
+    QColor,
+    QTextCharFormat,
+    QTextCursor,
+    QTextDocument,
+    QFont,
+    QSyntaxHighlighter
+)
 
 
 ###############################################################################
 # 1. Text Generation (OpenAI) Setup
 ###############################################################################
 
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Sent unchanged with every request, so it is built once here
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are a simple assistant that provides brief and straightforward answers."
+}
+
+
 def create_text_generation_pipeline(api_key, model_name="gpt-3.5-turbo"):
     """
-    Creates a function that calls the OpenAI Chat API,
-    using the specified GPT model by default.
+    Creates a coroutine function that calls the OpenAI Chat API,
+    using the specified GPT model by default. All calls share one aiohttp
+    session; await the returned function's close() when done with it.
     """
     if not api_key:
         raise ValueError(
             "No API key provided. Please set the OPENAI_API_KEY environment variable."
         )
 
-    openai.api_key = api_key
+    # openai (and the aiohttp stack under it) is slow to import, so it is
+    # only loaded, and these are only filled in, on the first request
+    openai = None
+    acreate = None
+    session = None
 
-    def generator(prompt, max_tokens=50, temperature=1.0):
+    async def generator(prompt, max_tokens=50, temperature=1.0, on_token=None):
         """
         Generate text using the OpenAI ChatCompletion API with adjusted parameters
-        to simulate a less capable model.
+        to simulate a less capable model. Awaiting it never blocks the Qt loop.
+        The reply is streamed; each piece is passed to on_token as it arrives.
         """
         try:
-            response = openai.ChatCompletion.create(
+            response = await acreate(
                 model=model_name,
-                messages=[
-                    {"role": "system", "content": "You are a simple assistant that provides brief and straightforward answers."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=(SYSTEM_MESSAGE, {"role": "user", "content": prompt}),
                 max_tokens=max_tokens,
-                temperature=temperature
+                temperature=temperature,
+                stream=True
             )
-            return response.choices[0].message.content.strip()
+            pieces = []
+            async for chunk in response:
+                delta = chunk.choices[0].delta.get("content", "")
+                if not delta:
+                    continue
+                pieces.append(delta)
+                if on_token is not None:
+                    on_token(delta)
+                    # Let Qt repaint between tokens
+                    await asyncio.sleep(0)
+            return "".join(pieces).strip()
         except Exception as e:
             print(f"Error calling OpenAI API: {e}")
             return ""
 
-    return generator
+    cached_generator = create_cached_generator(generator)
+
+    async def session_generator(prompt, max_tokens=50, temperature=1.0, on_token=None):
+        nonlocal openai, acreate, session
+
+        if session is None:
+            import aiohttp
+            import openai
+
+            openai.api_key = api_key
+            acreate = openai.ChatCompletion.acreate
+            # Created here so it belongs to the running event loop
+            session = aiohttp.ClientSession()
+
+        # openai.aiosession is a ContextVar and each task runs in its own
+        # copy of the context, so the shared session is bound per call
+        token = openai.aiosession.set(session)
+        try:
+            return await cached_generator(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                on_token=on_token
+            )
+        finally:
+            openai.aiosession.reset(token)
+
+    async def close():
+        if session is not None:
+            await session.close()
+
+    session_generator.close = close
+    return session_generator
+
+
+def create_cached_generator(generator, maxsize=256, similarity_threshold=0.95):
+    """
+    Wraps a generator coroutine with an in-memory response cache. Exact
+    repeats of a prompt are served from an LRU; otherwise the prompt is
+    embedded and a cached response is reused if an earlier prompt with the
+    same parameters is similar enough (cosine similarity).
+    """
+    exact_cache = OrderedDict()
+    # params -> (matrix of normalized embeddings, one row per response,
+    #            list of responses); a lookup is a single matrix-vector product
+    semantic_cache = {}
+
+    # Imported by the first embed() call, like openai in the pipeline
+    np = None
+    openai = None
+
+    async def embed(prompt):
+        nonlocal np, openai
+        if np is None:
+            import numpy as np
+            import openai
+
+        try:
+            response = await openai.Embedding.acreate(
+                model=EMBEDDING_MODEL,
+                input=prompt
+            )
+        except Exception as e:
+            print(f"Error calling OpenAI Embedding API: {e}")
+            return None
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def lookup_similar(params, embedding):
+        if embedding is None:
+            return None
+        matrix, responses = semantic_cache[params]
+        similarities = matrix @ embedding
+        best = int(similarities.argmax())
+        if similarities[best] > similarity_threshold:
+            return responses[best]
+        return None
+
+    async def cached_generator(prompt, max_tokens=50, temperature=1.0, on_token=None):
+        params = (max_tokens, temperature)
+        key = (prompt, params)
+
+        cached = None
+        embedded = False
+        embedding = None
+        if key in exact_cache:
+            exact_cache.move_to_end(key)
+            cached = exact_cache[key]
+        elif params in semantic_cache:
+            # There is something to compare against, so the embedding is
+            # worth waiting for before deciding to call the API
+            embedding = await embed(prompt)
+            embedded = True
+            cached = lookup_similar(params, embedding)
+
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached)
+            return cached
+
+        call = generator(
+            prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            on_token=on_token
+        )
+        if embedded:
+            result = await call
+        else:
+            # Nothing to compare against yet: embed the prompt alongside the
+            # chat request so the first token isn't held up
+            embedding, result = await asyncio.gather(embed(prompt), call)
+        if not result:
+            # Don't remember failed calls
+            return result
+
+        exact_cache[key] = result
+        if len(exact_cache) > maxsize:
+            exact_cache.popitem(last=False)
+
+        if embedding is not None:
+            if params in semantic_cache:
+                matrix, responses = semantic_cache[params]
+                matrix = np.vstack((matrix, embedding))
+                responses.append(result)
+                if len(responses) > maxsize:
+                    matrix = matrix[1:]
+                    del responses[0]
+            else:
+                matrix, responses = embedding[None, :], [result]
+            semantic_cache[params] = (matrix, responses)
+
+        return result
+
+    return cached_generator
+
+
+async def generate_batch(generator, prompts, max_tokens=50, temperature=1.0):
+    """
+    Runs several prompts through a generator concurrently and returns the
+    replies in the same order as the prompts.
+    """
+    return await asyncio.gather(*(
+        generator(prompt, max_tokens=max_tokens, temperature=temperature)
+        for prompt in prompts
+    ))
 
 
 ###############################################################################
 # 2. Syntax Highlighter for the Code Editor
 ###############################################################################
 
+KEYWORDS = frozenset({
+    "def", "class", "import", "from", "as",
+    "if", "elif", "else", "while", "for",
+    "in", "return", "with", "try", "except",
+    "raise", "pass", "None", "True", "False"
+})
+
+# Block states used to carry triple-quoted strings across lines
+NORMAL = 0
+IN_TRIPLE_DOUBLE = 1
+IN_TRIPLE_SINGLE = 2
+
+# How long typing must pause before a block-state change is propagated
+# down the rest of the document
+CASCADE_DELAY_MS = 50
+
+# Number of (text, state) -> tokens results remembered by the highlighter
+TOKEN_CACHE_SIZE = 4096
+
+# Compiled once per process and shared by every PythonHighlighter.
+#
+# Identifiers, strings and comments folded into a single regex; an
+# identifier is a keyword if it is in KEYWORDS (one hash lookup, however
+# long the keyword list gets). Strings honour backslash escapes and an
+# unterminated one runs to the end of the line; a '#' inside a string is
+# consumed by the string. Triple-quoted strings come first so they win
+# over the one-line forms; their optional closing group tells us if they
+# stay open. String bodies are written as "normal* (special normal*)*" so
+# plain runs are consumed in bulk and no input can be split two ways,
+# which keeps matching linear even on long unterminated strings.
+_MASTER_RE = re.compile(
+    r'(?P<tdq>"""[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*(?P<tdqEnd>""")?)'
+    r"|(?P<tsq>'''[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*(?P<tsqEnd>''')?)"
+    r"|(?P<ident>\b[^\W\d]\w*)"
+    r"|(?P<str>\"[^\"\\]*(?:\\.[^\"\\]*)*\"?|'[^'\\]*(?:\\.[^'\\]*)*'?)"
+    r"|(?P<cmt>#.*)"
+)
+
+# Scanners for the rest of a triple-quoted string carried over from the
+# previous block, keyed by block state
+_TRIPLE_END_RES = {
+    IN_TRIPLE_DOUBLE: re.compile(r'[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"""'),
+    IN_TRIPLE_SINGLE: re.compile(r"[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''"),
+}
+
+
 class PythonHighlighter(QSyntaxHighlighter):
     """
     A basic syntax highlighter for Python code. You can expand the patterns
     and formatting rules to match more advanced syntax.
     """
+    master = _MASTER_RE
+    tripleEnds = _TRIPLE_END_RES
+
     def __init__(self, parent=None):
-        super(PythonHighlighter, self).__init__(parent)
+        # The parent is attached late, below: QSyntaxHighlighter(document)
+        # would hook contentsChange before noteEdit could be connected
+        super(PythonHighlighter, self).__init__(None)
 
         # Define formats
         self.keywordFormat = QTextCharFormat()
@@ -83,53 +312,140 @@ class PythonHighlighter(QSyntaxHighlighter):
         self.commentFormat = QTextCharFormat()
         self.commentFormat.setForeground(QColor("#5c6370"))  # Gray
 
-        # Define regex patterns
-        self.keywords = [
-            r"\bdef\b", r"\bclass\b", r"\bimport\b", r"\bfrom\b", r"\bas\b",
-            r"\bif\b", r"\belif\b", r"\belse\b", r"\bwhile\b", r"\bfor\b",
-            r"\bin\b", r"\breturn\b", r"\bwith\b", r"\btry\b", r"\bexcept\b",
-            r"\braise\b", r"\bpass\b", r"\bNone\b", r"\bTrue\b", r"\bFalse\b"
-        ]
-        self.keywordPatterns = [r"{}".format(kw) for kw in self.keywords]
-
-        self.stringPatterns = [
-            r"\".*?\"",   # Double quotes
-            r"\'.*?\'"    # Single quotes
-        ]
-
-        # Comment pattern
-        self.commentPatterns = [
-            r"#.*",  # Single line
-        ]
+        self.formats = {
+            "kw": self.keywordFormat,
+            "str": self.stringFormat,
+            "cmt": self.commentFormat,
+        }
+
+        self.tokenCache = OrderedDict()
+
+        # Opening or closing a triple-quoted string changes the block state,
+        # and Qt then rehighlights every following block. While the user is
+        # typing, that cascade is held back until they pause.
+        self.editedBlock = None
+        self.pendingBlocks = []
+        self.cascadeTimer = QTimer(self)
+        self.cascadeTimer.setSingleShot(True)
+        self.cascadeTimer.setInterval(CASCADE_DELAY_MS)
+        self.cascadeTimer.timeout.connect(self.flushCascade)
+
+        if parent is not None:
+            self.setParent(parent)
+            if isinstance(parent, QTextDocument):
+                self.setDocument(parent)
+            elif isinstance(parent, QTextEdit):
+                self.setDocument(parent.document())
+
+    def setDocument(self, document):
+        old = self.document()
+        if old is not None:
+            old.contentsChange.disconnect(self.noteEdit)
+        # Connected before QSyntaxHighlighter's own hook so noteEdit runs first
+        if document is not None:
+            document.contentsChange.connect(self.noteEdit)
+        super(PythonHighlighter, self).setDocument(document)
+
+    def noteEdit(self, position, removed, added):
+        # Same last block QSyntaxHighlighter visits for this edit before it
+        # starts following state changes
+        self.editedBlock = self.document().findBlock(
+            position + added + (1 if removed > 0 else 0)
+        )
+
+    def flushCascade(self):
+        pending, self.pendingBlocks = self.pendingBlocks, []
+        for block in pending:
+            if block.isValid():
+                self.rehighlightBlock(block)
 
     def highlightBlock(self, text):
-        import re
-        # Highlight keywords
-        for pattern in self.keywordPatterns:
-            expression = re.compile(pattern)
-            for match in expression.finditer(text):
-                start, end = match.span()
-                self.setFormat(start, end - start, self.keywordFormat)
-
-        # Highlight strings
-        for pattern in self.stringPatterns:
-            expression = re.compile(pattern)
-            for match in expression.finditer(text):
-                start, end = match.span()
-                self.setFormat(start, end - start, self.stringFormat)
-
-        # Highlight comments
-        for pattern in self.commentPatterns:
-            expression = re.compile(pattern)
-            for match in expression.finditer(text):
-                start, end = match.span()
-                self.setFormat(start, end - start, self.commentFormat)
+        oldState = self.currentBlockState()
+
+        # Blocks are often re-highlighted with the same text and incoming
+        # state (cascades, rehighlight(), repeated lines); reuse the tokens
+        key = (text, self.previousBlockState())
+        tokens = self.tokenCache.get(key)
+        if tokens is None:
+            tokens = self.tokenize(text, key[1])
+            self.tokenCache[key] = tokens
+            if len(self.tokenCache) > TOKEN_CACHE_SIZE:
+                self.tokenCache.popitem(last=False)
+        else:
+            self.tokenCache.move_to_end(key)
+        ranges, state = tokens
+
+        # Tokenizing is done; apply the collected ranges in one go
+        formats = self.formats
+        for start, length, kind in ranges:
+            self.setFormat(start, length, formats[kind])
+
+        if self.editedBlock is not None and self.currentBlock() == self.editedBlock:
+            self.editedBlock = None
+            if state != oldState:
+                # Keep the old state for now so Qt stops here; flushCascade
+                # rehighlights this block with the real state later
+                state = oldState
+                self.pendingBlocks.append(self.currentBlock())
+                self.cascadeTimer.start()
+
+        self.setCurrentBlockState(state)
+
+    def tokenize(self, text, state):
+        """
+        Splits one block into (start, length, kind) ranges, where kind is a
+        key of self.formats, and returns them with the block's end state.
+        Touches no Qt objects. Adjacent ranges of the same kind are merged.
+        """
+        ranges = []
+        start = 0
+
+        if state in self.tripleEnds:
+            match = self.tripleEnds[state].match(text)
+            if match is None:
+                # Still inside the string: no keyword/comment work at all
+                return [(0, len(text), "str")], state
+            start = match.end()
+            ranges.append((0, start, "str"))
+
+        state = NORMAL
+
+        # One pass of the master pattern; the matching group picks the kind
+        for match in self.master.finditer(text, start):
+            start, end = match.span()
+            kind = match.lastgroup
+
+            if kind == "ident":
+                if text[start:end] not in KEYWORDS:
+                    continue
+                kind = "kw"
+            elif kind == "tdq":
+                if match.group("tdqEnd") is None:
+                    state = IN_TRIPLE_DOUBLE
+                kind = "str"
+            elif kind == "tsq":
+                if match.group("tsqEnd") is None:
+                    state = IN_TRIPLE_SINGLE
+                kind = "str"
+
+            if ranges:
+                lastStart, lastLength, lastKind = ranges[-1]
+                if lastKind == kind and lastStart + lastLength == start:
+                    ranges[-1] = (lastStart, end - lastStart, kind)
+                    continue
+            ranges.append((start, end - start, kind))
+
+        return ranges, state
 
 
 ###############################################################################
 # 3. Main Application Window
 ###############################################################################
 
+# Matches any URL that already carries a scheme (http://, https://, file://...)
+_HAS_SCHEME = re.compile(r"[a-z][a-z0-9+.\-]*://", re.IGNORECASE).match
+
+
 class MainWindow(QMainWindow):
     def __init__(self, api_key, model_name="gpt-3.5-turbo"):
         super().__init__()
@@ -158,6 +474,7 @@ class MainWindow(QMainWindow):
         self.tab_widget.addTab(self.tab_text_gen, "Text Generation")
         self.tab_widget.addTab(self.tab_code_editor, "Code Editor")
         self.tab_widget.addTab(self.tab_browser, "Web Browser")
+        self.tab_widget.currentChanged.connect(self.on_tab_changed)
 
 
     ###########################################################################
@@ -178,6 +495,8 @@ class MainWindow(QMainWindow):
         self.result_text = QTextEdit()
         self.result_text.setReadOnly(True)
 
+        self._generate_task = None
+
         layout.addWidget(self.prompt_label)
         layout.addWidget(self.prompt_input)
         layout.addWidget(self.generate_button)
@@ -193,10 +512,38 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please enter a prompt.")
             return
 
+        # Streamed tokens go straight into result_text, so only one request
+        # may be in flight at a time
+        self.generate_button.setEnabled(False)
+
+        # Run the request on the asyncio loop so the GUI stays responsive.
+        # asyncio only keeps weak references to tasks, so hold on to it.
+        self._generate_task = asyncio.ensure_future(self._do_generate(prompt))
+        self._generate_task.add_done_callback(self._on_generate_done)
+
+    def _on_generate_done(self, task):
+        if task is self._generate_task:
+            self._generate_task = None
+        self.generate_button.setEnabled(True)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error generating text: {task.exception()}")
+
+    async def _do_generate(self, prompt):
+        self.result_text.clear()
+
         # Using the ChatCompletion API with gpt-3.5-turbo and adjusted parameters
-        generated_text = self.generator(prompt, max_tokens=50, temperature=1.0)
+        generated_text = await self.generator(
+            prompt,
+            max_tokens=50,
+            temperature=1.0,
+            on_token=self.append_result
+        )
         self.result_text.setPlainText(generated_text)
 
+    def append_result(self, text):
+        self.result_text.moveCursor(QTextCursor.End)
+        self.result_text.insertPlainText(text)
+
 
     ###########################################################################
     # Tab 2: Code Editor with Syntax Highlighting
@@ -230,18 +577,35 @@ class MainWindow(QMainWindow):
         nav_layout.addWidget(self.url_input)
         nav_layout.addWidget(self.load_button)
 
-        self.webview = QWebEngineView()
-        self.webview.setUrl(QUrl(self.url_input.text()))
+        # The web view itself is created by create_webview the first time
+        # this tab is shown
+        self.webview = None
+        self.browser_layout = layout
 
         layout.addLayout(nav_layout)
-        layout.addWidget(self.webview)
         widget.setLayout(layout)
         return widget
 
+    def on_tab_changed(self, index):
+        if self.tab_widget.widget(index) is self.tab_browser:
+            self.create_webview()
+
+    def create_webview(self):
+        if self.webview is not None:
+            return
+
+        # QtWebEngine is large; only load it once the browser is needed
+        from PyQt5.QtWebEngineWidgets import QWebEngineView
+
+        self.webview = QWebEngineView()
+        self.webview.setUrl(QUrl(self.url_input.text()))
+        self.browser_layout.addWidget(self.webview)
+
     def load_url(self):
         url = self.url_input.text().strip()
-        if not url.startswith("http://") and not url.startswith("https://"):
+        if not _HAS_SCHEME(url):
             url = "https://" + url
+        self.create_webview()
         self.webview.setUrl(QUrl(url))
 
 
@@ -250,8 +614,14 @@ class MainWindow(QMainWindow):
 ###############################################################################
 
 def main():
+    # Required for importing QtWebEngineWidgets after QApplication exists
+    QApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
     app = QApplication(sys.argv)
 
+    # Drive asyncio from the Qt event loop so API calls don't freeze the UI
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
+
     # Securely retrieve your API key from environment variables
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
@@ -266,7 +636,12 @@ def main():
         model_name=model_name
     )
     window.show()
-    sys.exit(app.exec_())
+
+    with loop:
+        rc = loop.run_forever()
+        loop.run_until_complete(window.generator.close())
+
+    sys.exit(rc)
 
 if __name__ == "__main__":
     main()